@@ -1,13 +1,37 @@
+import atexit
 import requests
-from bs4 import BeautifulSoup
-import re
-from datetime import datetime
+from datetime import datetime, timezone
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
-import time
+import threading
+import lxml.etree
+import lxml.html
+import msgspec
+from diskcache import Cache
+from console import print_lock
+from http_session import SESSION, USER_AGENT
+
+FR24_API_URL = "https://api.flightradar24.com/common/v1/flight/list.json"
+CACHE_DIR = "./fr24_cache"
+FR24_API_HEADERS = {
+    "Accept": "application/json",
+    "Origin": "https://www.flightradar24.com",
+    "Referer": "https://www.flightradar24.com/",
+}
+
+# True once the flight table has a data row with text in it; checked in the
+# browser so each poll is a single WebDriver round-trip
+TABLE_POPULATED_SCRIPT = """
+const rows = document.querySelectorAll('#tbl-datatable tr');
+return rows.length > 1 && rows[1].textContent.trim() !== '';
+"""
+
+# Chrome WebDriver shared by all Selenium lookups, see get_driver()
+_driver = None
+_driver_lock = threading.Lock()
 
 
 def setup_selenium_driver():
@@ -17,10 +41,19 @@ def setup_selenium_driver():
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
     chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--window-size=1920,1080")
-    chrome_options.add_argument(
-        "--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+    chrome_options.add_argument("--window-size=1280,800")
+    # Only the flight table is needed, so skip images and don't wait for
+    # every subresource before handing control back
+    chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+    chrome_options.add_experimental_option(
+        "prefs",
+        {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.default_content_setting_values.cookies": 1,
+        },
     )
+    chrome_options.page_load_strategy = "eager"
+    chrome_options.add_argument(f"--user-agent={USER_AGENT}")
 
     return webdriver.Chrome(options=chrome_options)
 
@@ -33,30 +66,286 @@ def print_progress(message, success=None):
         indicator = "✅"  # Success
     else:
         indicator = "❌"  # Failed
-    print(f"{indicator} {message}")
+    with print_lock:
+        print(f"{indicator} {message}")
 
 
-def get_latest_flight_status_selenium(url):
-    """Fetch and parse the latest flight status from Flightradar24 using Selenium."""
+def print_flight_info(heading, flight_info):
+    """Print the details of a flight found in the flight history."""
+    with print_lock:
+        print(f"\n✈️ {heading}:")
+        print(f"  • Date: {flight_info['date']}")
+        print(f"  • Flight: {flight_info['flight_number']}")
+        print(f"  • From: {flight_info['from']}")
+        print(f"  • To: {flight_info['to']}")
+        print(f"  • Status: {flight_info['status']}")
+
+
+class AirportCode(msgspec.Struct):
+    iata: str | None = None
+
+
+class Airport(msgspec.Struct):
+    name: str | None = None
+    code: AirportCode | None = None
+
+
+class FlightAirports(msgspec.Struct):
+    origin: Airport | None = None
+    destination: Airport | None = None
+
+
+class FlightNumber(msgspec.Struct):
+    default: str | None = None
+
+
+class FlightIdentification(msgspec.Struct):
+    number: FlightNumber | None = None
+
+
+class FlightStatus(msgspec.Struct):
+    text: str | None = None
+
+
+class ScheduledTimes(msgspec.Struct):
+    departure: int | None = None
+
+
+class FlightTimes(msgspec.Struct):
+    scheduled: ScheduledTimes | None = None
+
+
+class FlightRow(msgspec.Struct):
+    """One entry of the Flightradar24 flight list, with only the fields we use."""
+
+    identification: FlightIdentification | None = None
+    status: FlightStatus | None = None
+    airport: FlightAirports | None = None
+    time: FlightTimes | None = None
+
+
+class FR24FlightList(msgspec.Struct):
+    data: list[FlightRow] | None = None
+
+
+class FR24Result(msgspec.Struct):
+    response: FR24FlightList
+
+
+class FR24Envelope(msgspec.Struct):
+    """Envelope of the Flightradar24 flight list API response."""
+
+    result: FR24Result
+
+
+def format_airport(airport):
+    """Format an API airport entry the way the Flightradar24 table shows it."""
+    if airport is None:
+        return "Unknown"
+    code = airport.code.iata if airport.code else None
+    if airport.name and code:
+        return f"{airport.name} ({code})"
+    return airport.name or code or "Unknown"
+
+
+def flight_status_text(flight):
+    """Return the status text of an API flight entry, e.g. "Landed 14:35"."""
+    return (flight.status.text or "").strip() if flight.status else ""
+
+
+def parse_api_flight(flight, timestamp):
+    """Convert a Flightradar24 API flight entry into a flight info dict."""
+    scheduled = flight.time.scheduled if flight.time else None
+    departure = scheduled.departure if scheduled else None
+    date = (
+        datetime.fromtimestamp(departure, tz=timezone.utc).strftime("%d %b %Y")
+        if departure
+        else "Unknown"
+    )
+    number = flight.identification.number if flight.identification else None
+    airports = flight.airport or FlightAirports()
+    return {
+        "date": date,
+        "from": format_airport(airports.origin),
+        "to": format_airport(airports.destination),
+        "flight_number": (number.default if number else None) or "N/A",
+        "status": flight_status_text(flight),
+        "timestamp": timestamp,
+    }
+
+
+def get_latest_flight_status(registration, session=None):
+    """Fetch the latest flight status from the Flightradar24 JSON API."""
+    clean_reg = registration.replace("-", "").lower()
+    params = {"query": clean_reg, "fetchBy": "reg", "page": 1, "limit": 25}
+    session = session or SESSION
+
     try:
-        print("\n🔄 Starting Selenium process...")
+        print_progress(f"Requesting flight list for {registration}")
+        response = session.get(
+            FR24_API_URL, params=params, headers=FR24_API_HEADERS, timeout=(3, 10)
+        )
+        response.raise_for_status()
+        # Decode straight into typed structs, skipping every field we don't use
+        decoded = msgspec.json.decode(response.content, type=FR24Envelope)
+        data = decoded.result.response.data or []
+        print_progress(f"Received {len(data)} flight(s)", True)
+    except (requests.RequestException, msgspec.DecodeError) as e:
+        print_progress(f"Flightradar24 API error: {str(e)}", False)
+        return None
+
+    recent_flight = None
+    next_flight = None
+    timestamp = datetime.now().isoformat()
+
+    # Flights are listed newest first, so the first match of each kind wins
+    for flight in data:
+        status_text = flight_status_text(flight)
+
+        if "Landed" in status_text and not recent_flight:
+            recent_flight = parse_api_flight(flight, timestamp)
+            print_flight_info("Found most recent flight", recent_flight)
+
+        if "Estimated" in status_text and not next_flight:
+            next_flight = parse_api_flight(flight, timestamp)
+            print_flight_info("Found next flight", next_flight)
+
+        if recent_flight and next_flight:
+            break
+
+    return {
+        "recent_flight": recent_flight,
+        "next_flight": next_flight,
+        "timestamp": timestamp,
+    }
+
+
+def _cell_text(cell):
+    """Return the text of a table cell with whitespace collapsed."""
+    return " ".join(cell.text_content().split())
+
+
+def parse_flight_table(table):
+    """Parse the Flightradar24 flight history table from its lxml element."""
+    recent_flight = None
+    next_flight = None
+    timestamp = datetime.now().isoformat()
+
+    # Look through rows to find most recent landed flight and next estimated flight
+    for row in table.xpath(".//tr")[1:]:  # Skip header row
+        cells = row.xpath("./td")
+        if len(cells) < 12:  # Skip rows without enough cells
+            continue
+
+        status_text = _cell_text(cells[11])
+
+        # Extract flight info from the row
+        flight_info = {
+            "date": _cell_text(cells[2]),
+            "from": _cell_text(cells[3]),
+            "to": _cell_text(cells[4]),
+            "flight_number": _cell_text(cells[5]),
+            "status": status_text,
+            "timestamp": timestamp,
+        }
+
+        # Check if this is a landed flight
+        if "Landed" in status_text and not recent_flight:
+            recent_flight = flight_info
+            print_flight_info("Found most recent flight", flight_info)
+
+        # Check if this is an estimated departure
+        if "Estimated" in status_text and not next_flight:
+            next_flight = flight_info
+            print_flight_info("Found next flight", flight_info)
+
+        # If we found both flights, we can stop looking
+        if recent_flight and next_flight:
+            break
+
+    return {
+        "recent_flight": recent_flight,
+        "next_flight": next_flight,
+        "timestamp": timestamp,
+    }
+
+
+def get_latest_flight_status_static(url, session=None):
+    """Fetch and parse the flight history table from the page's plain HTML."""
+    session = session or SESSION
+
+    try:
+        print_progress("Fetching flight history page")
+        response = session.get(url, timeout=(3, 10))
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print_progress(f"Flight history page error: {str(e)}", False)
+        return None
+
+    try:
+        page = lxml.html.fromstring(response.content)
+    except lxml.etree.ParserError as e:
+        # Empty bodies (e.g. 204 or a blocked request) can't be parsed at all
+        print_progress(f"Flight history page error: {str(e)}", False)
+        return None
+    table = page.get_element_by_id("tbl-datatable", None)
+
+    # The rows are usually filled in by JavaScript, leaving the table empty
+    if table is None or not table.xpath(".//tr[count(td) >= 12]"):
+        print_progress("Flight table is not server-rendered", False)
+        return None
+
+    print_progress("Flight table found in page HTML", True)
+    return parse_flight_table(table)
+
+
+def get_driver():
+    """Return the shared Chrome WebDriver, starting it on first use."""
+    global _driver
+    if _driver is None:
         print_progress("Initializing Chrome WebDriver")
-        driver = setup_selenium_driver()
+        _driver = setup_selenium_driver()
         print_progress("WebDriver initialized", True)
+    return _driver
+
+
+def close_driver():
+    """Quit the shared Chrome WebDriver if it has been started."""
+    global _driver
+    if _driver is None:
+        return
+    print_progress("Closing WebDriver")
+    try:
+        _driver.quit()
+    except Exception as e:
+        print_progress(f"Error closing WebDriver: {str(e)}", False)
+    _driver = None
+    print_progress("WebDriver closed", True)
+
+
+atexit.register(close_driver)
+
+
+def get_latest_flight_status_selenium(url, driver=None):
+    """Fetch and parse the latest flight status from Flightradar24 using Selenium."""
+    shared_driver = driver is None
+    try:
+        with print_lock:
+            print("\n🔄 Starting Selenium process...")
+        # One browser serves every lookup, so only one thread may drive it
+        with _driver_lock:
+            driver = driver or get_driver()
 
-        try:
             print_progress("Loading page URL")
             driver.get(url)
             print_progress("Page load started", True)
 
             # Wait for the table to load
-            wait = WebDriverWait(driver, 20)
+            wait = WebDriverWait(driver, 20, poll_frequency=0.1)
 
             try:
                 print_progress("Waiting for data table to appear")
-                table = wait.until(
-                    EC.presence_of_element_located((By.ID, "tbl-datatable"))
-                )
+                wait.until(EC.presence_of_element_located((By.ID, "tbl-datatable")))
                 print_progress("Data table found", True)
 
                 print_progress("Waiting for loading message to disappear")
@@ -68,95 +357,56 @@ def get_latest_flight_status_selenium(url):
                 print_progress("Loading message disappeared", True)
 
                 print_progress("Waiting for JavaScript data population")
-                time.sleep(5)
-                print_progress("Extra wait time completed", True)
-
-                print("\n🔍 Searching for flight data...")
-
-                # Find all rows in the table
-                rows = table.find_elements(By.TAG_NAME, "tr")
-
-                # Skip header row
-                data_rows = rows[1:]
-
-                recent_flight = None
-                next_flight = None
-
-                # Look through rows to find most recent landed flight and next estimated flight
-                for row in data_rows:
-                    cells = row.find_elements(By.TAG_NAME, "td")
-                    if len(cells) < 12:  # Skip rows without enough cells
-                        continue
-
-                    status_cell = cells[11]
-                    status_text = status_cell.text.strip()
-
-                    # Extract flight info from the row
-                    flight_info = {
-                        "date": cells[2].text.strip(),
-                        "from": cells[3].text.strip(),
-                        "to": cells[4].text.strip(),
-                        "flight_number": cells[5].text.strip(),
-                        "status": status_text,
-                        "timestamp": datetime.now().isoformat(),
-                    }
-
-                    # Check if this is a landed flight
-                    if "Landed" in status_text and not recent_flight:
-                        recent_flight = flight_info
-                        print("\n✈️ Found most recent flight:")
-                        print(f"  • Date: {flight_info['date']}")
-                        print(f"  • Flight: {flight_info['flight_number']}")
-                        print(f"  • From: {flight_info['from']}")
-                        print(f"  • To: {flight_info['to']}")
-                        print(f"  • Status: {flight_info['status']}")
-
-                    # Check if this is an estimated departure
-                    if "Estimated" in status_text and not next_flight:
-                        next_flight = flight_info
-                        print("\n✈️ Found next flight:")
-                        print(f"  • Date: {flight_info['date']}")
-                        print(f"  • Flight: {flight_info['flight_number']}")
-                        print(f"  • From: {flight_info['from']}")
-                        print(f"  • To: {flight_info['to']}")
-                        print(f"  • Status: {flight_info['status']}")
-
-                    # If we found both flights, we can stop looking
-                    if recent_flight and next_flight:
-                        break
-
-                result = {
-                    "recent_flight": recent_flight if recent_flight else None,
-                    "next_flight": next_flight if next_flight else None,
-                    "timestamp": datetime.now().isoformat(),
-                }
-
-                return result
+                wait.until(lambda d: d.execute_script(TABLE_POPULATED_SCRIPT))
+                print_progress("Flight rows populated", True)
 
-            except Exception as e:
-                print_progress(
-                    f"Error while waiting for or parsing data: {str(e)}", False
+                # The rows are in, so stop any remaining map tiles, ads and
+                # trackers from loading; earlier this would cancel the
+                # table's own data request
+                driver.execute_script("window.stop();")
+
+                with print_lock:
+                    print("\n🔍 Searching for flight data...")
+
+                # Grab the whole table in one round-trip and parse it locally
+                html = driver.execute_script(
+                    "return document.getElementById('tbl-datatable').outerHTML"
                 )
-                print("\n🔍 Debug Information:")
-                print("  • Current URL:", driver.current_url)
-                print("  • Page Title:", driver.title)
-                print("  • Error Type:", type(e).__name__)
+                return parse_flight_table(lxml.html.fromstring(html))
+
+            except Exception as e:
+                # Query the browser before taking the lock to keep it short
+                current_url = driver.current_url
+                title = driver.title
+                with print_lock:
+                    print_progress(
+                        f"Error while waiting for or parsing data: {str(e)}", False
+                    )
+                    print("\n🔍 Debug Information:")
+                    print("  • Current URL:", current_url)
+                    print("  • Page Title:", title)
+                    print("  • Error Type:", type(e).__name__)
                 return None
 
-        finally:
-            print_progress("Closing WebDriver")
-            driver.quit()
-            print_progress("WebDriver closed", True)
+            finally:
+                # Don't let this lookup's session bleed into the next one
+                driver.delete_all_cookies()
 
     except Exception as e:
-        print_progress(f"Selenium error: {str(e)}", False)
-        print("\n❌ Error Details:")
-        print(f"  • Type: {type(e).__name__}")
         import traceback
 
-        print("  • Traceback:")
-        for line in traceback.format_exc().split("\n"):
-            print(f"    {line}")
+        with print_lock:
+            print_progress(f"Selenium error: {str(e)}", False)
+            print("\n❌ Error Details:")
+            print(f"  • Type: {type(e).__name__}")
+            print("  • Traceback:")
+            for line in traceback.format_exc().split("\n"):
+                print(f"    {line}")
+
+        # The shared browser may be unusable now; start a fresh one next time
+        if shared_driver:
+            with _driver_lock:
+                close_driver()
         return None
 
 
@@ -176,18 +426,53 @@ def process_registration(registration):
     fr24_url = generate_fr24_url(registration)
     result = {"registration": registration, "fr24_url": fr24_url}
 
-    # Try to get the flight status using Selenium
-    flight_data = get_latest_flight_status_selenium(fr24_url)
+    # Try the JSON API first, then the plain page HTML, and only launch a
+    # browser if neither of them gives us the flight history
+    flight_data = get_latest_flight_status(registration)
+    if flight_data is None:
+        flight_data = get_latest_flight_status_static(fr24_url)
+    if flight_data is None:
+        flight_data = get_latest_flight_status_selenium(fr24_url)
     if flight_data:
         result.update(flight_data)
 
     return result
 
 
+def cache_ttl(result):
+    """Return how many seconds a lookup result stays fresh in the cache."""
+    if result.get("next_flight"):
+        return 60  # Upcoming departure, the status changes quickly
+    if result.get("recent_flight"):
+        return 3600  # Aircraft is on the ground after its last flight
+    return 300  # Nothing found, retry after a short while
+
+
+def lookup_registration(registration):
+    """Process a registration, reusing a cached result while it is fresh."""
+    if not registration:
+        return None
+
+    key = registration.upper()
+    with Cache(CACHE_DIR) as cache:
+        result = cache.get(key)
+        if result is not None:
+            print_progress(f"Using cached flight data for {key}", True)
+            return result
+
+        result = process_registration(registration)
+
+        # Only cache completed lookups so transient failures are retried
+        if result and "timestamp" in result:
+            cache.set(key, result, expire=cache_ttl(result))
+
+    return result
+
+
 if __name__ == "__main__":
     # Example usage
     test_reg = "OY-RCM"
-    result = process_registration(test_reg)
+    result = lookup_registration(test_reg)
     if result:
         print(f"Aircraft Registration: {result['registration']}")
         print(f"Flightradar24 URL: {result['fr24_url']}")
@@ -0,0 +1,6 @@
+import threading
+
+# OCR and lookups run from worker threads; hold this while printing so that
+# multi-line output from different workers doesn't interleave. Reentrant so
+# helpers that print can be called while a block of output is being written.
+print_lock = threading.RLock()
@@ -0,0 +1,19 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+
+
+def setup_session():
+    """Setup and return a requests Session with keep-alive connection pooling."""
+    session = requests.Session()
+    # Worker threads share the session, so keep enough connections per host
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+# Shared by the image downloads and the Flightradar24 API so that
+# connections (and TLS handshakes) are reused across requests
+SESSION = setup_session()
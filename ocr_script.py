@@ -1,40 +1,85 @@
 import requests
-from PIL import Image
+import urllib3
+from PIL import Image, ImageOps, UnidentifiedImageError
 import pytesseract
-from io import BytesIO
+from console import print_lock
+from http_session import SESSION
 
+# Longest side, in pixels, that images are downscaled to before OCR
+MAX_OCR_SIZE = 1600
 
-def extract_text_from_image(image_url):
-    # Download the image from the URL
-    response = requests.get(image_url)
-    if response.status_code != 200:
-        print(f"Failed to download image. Status code: {response.status_code}")
+# Tried in order until a registration is found; registrations only use
+# capitals, digits and hyphens, so the whitelisted pass usually suffices
+OCR_CONFIGS = [
+    "--oem 3 --psm 6 -c tessedit_char_whitelist=N0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ-",
+    # Fallbacks for images where the whitelisted pass finds nothing
+    "--oem 3 --psm 6",
+    "",
+]
+
+
+def load_image(image_url):
+    """Download an image and return it as an 8-bit grayscale PIL Image."""
+    try:
+        with SESSION.get(image_url, stream=True, timeout=(3, 10)) as response:
+            if response.status_code != 200:
+                with print_lock:
+                    print(
+                        f"Failed to download image. Status code: {response.status_code}"
+                    )
+                return None
+
+            # The raw stream can't seek, so Pillow reads the compressed body
+            # into memory itself; the saving comes from draft() below, which
+            # avoids decoding the full-size, full-colour image
+            response.raw.decode_content = True
+            image = Image.open(response.raw)
+
+            # Tesseract's runtime grows with pixel count, and registrations
+            # stay readable well below the resolution of a typical photo
+            scale = min(1.0, MAX_OCR_SIZE / max(image.size))
+            # Keep very thin images (e.g. 4000x2 banners) at least 1px wide
+            size = (
+                max(1, int(image.width * scale)),
+                max(1, int(image.height * scale)),
+            )
+
+            # Ask the JPEG decoder for grayscale at (roughly) the target size
+            # directly, so chroma and full-resolution pixels are never decoded
+            image.draft("L", size)
+            image.load()
+    except (
+        requests.RequestException,
+        urllib3.exceptions.HTTPError,
+        UnidentifiedImageError,
+        OSError,
+    ) as e:
+        # The body is only read by Image.open()/load(), so timeouts and dropped
+        # connections surface from urllib3 and bad bodies from Pillow
+        with print_lock:
+            print(f"Failed to load image: {str(e)}")
+        return None
+
+    if image.mode != "L":
+        image = image.convert("L")
+    if image.size != size:
+        image = image.resize(size, Image.LANCZOS)
+    return ImageOps.autocontrast(image)
+
+
+def iter_text_from_image(image_url):
+    """Yield the OCR text of an image, one Tesseract configuration at a time."""
+    image = load_image(image_url)
+    if image is None:
         return
 
-    # Convert the image data to a PIL Image object
-    image = Image.open(BytesIO(response.content))
-
-    # Try different OCR configurations
-    configs = [
-        # Default configuration
-        "",
-        # Use LSTM OCR Engine Mode with legacy character classifier
-        "--oem 3 --psm 6",
-        # Use LSTM OCR Engine Mode with legacy character classifier and whitelist characters
-        "--oem 3 --psm 6 -c tessedit_char_whitelist=N0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ",
-        # Use LSTM OCR Engine Mode with legacy character classifier and blacklist characters
-        "--oem 3 --psm 6 -c tessedit_char_blacklist=()[]{}",
-        # Use LSTM OCR Engine Mode with legacy character classifier and custom dictionary
-        "--oem 3 --psm 6 -c tessedit_char_whitelist=N0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ -c tessedit_char_blacklist=()[]{}",
-    ]
-
-    all_text = []
-    for i, config in enumerate(configs, 1):
-        text = pytesseract.image_to_string(image, config=config)
-        all_text.append(text.strip())
-
-    # Return the combined text from all configurations
-    return "\n".join(all_text)
+    for config in OCR_CONFIGS:
+        yield pytesseract.image_to_string(image, config=config).strip()
+
+
+def extract_text_from_image(image_url):
+    """Return the OCR text of an image from the first Tesseract pass."""
+    return next(iter_text_from_image(image_url), None)
 
 
 if __name__ == "__main__":
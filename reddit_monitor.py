@@ -1,57 +1,125 @@
 import praw
 import re
-from ocr_script import extract_text_from_image
-from aircraft_lookup import process_registration
+from ocr_script import iter_text_from_image
+from aircraft_lookup import lookup_registration
+from console import print_lock
 import os
 from dotenv import load_dotenv
 import time
+import sqlite3
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
 load_dotenv()
 
+SUBMISSIONS_DB = "submissions.db"
+LEGACY_SUBMISSIONS_CSV = "submissions.csv"
+
+# Number of images/registrations handled concurrently per submission
+MAX_WORKERS = 8
+
+IMAGE_EXTENSIONS = (
+    ".jpg",
+    ".jpeg",
+    ".png",
+    ".gif",  # Common formats
+    ".webp",  # Web-optimized format
+    ".bmp",
+    ".tiff",
+    ".tif",  # Other standard formats
+    ".heic",
+    ".heif",  # High-efficiency formats
+)
+
+# Pattern for aircraft registrations (e.g., OY-RCM, G-ABCD, N12345)
+_REGISTRATION_RE = re.compile(r"[A-Z]{1,2}-[A-Z0-9]{2,5}")
+
+# Registrations have to start at a word boundary, so "3D-VIEW" can't yield "D-VIEW"
+# N-numbers (US) - Must be N followed by at least 2 digits/letters
+_N_NUMBER = r"(?<![A-Z0-9-])N[1-9][0-9A-Z]{1,4}(?![A-Z0-9-])"
+# Standard hyphenated (e.g., G-ABCD, OY-RCM)
+_HYPHENATED = r"(?<![A-Z0-9-])(?:G|OY|SE|PH|D|F|EC|HB|TC|VH|ZK|JA|HL|B|VT|EI|4X|P4|A6|VP|C|LV|LN|SP|CS|RA|HS|RP|9M|PK)-[A-Z0-9]{3,5}(?![A-Z0-9-])"
+
+# Words that often create false positives
+FALSE_POSITIVES = frozenset(
+    {
+        "3D-ANSICHT",
+        "3D-VIEW",
+        "D-ANSIC",
+        "F-SUR",
+        "D-INFO",
+        "3D-AI",
+        "D-VIEW",
+        "F-SHARE",
+        "D-MENU",
+        "N-MENU",
+    }
+)
+
+# Both patterns in one alternation so the OCR text is only scanned once
+_EXTRACT_RE = re.compile(
+    f"(?P<n_number>{_N_NUMBER})|(?P<hyphenated>{_HYPHENATED})", re.IGNORECASE
+)
+_REG_TYPES = {"n_number": "N-number", "hyphenated": "Hyphenated"}
+
+# FAA rules: up to five digits, or up to four/three digits followed by one/two
+# letters, never using I or O (which OCR cleanup has already turned into 0)
+_VALID_N_NUMBER_RE = re.compile(
+    r"N[1-9](?:[0-9]{0,4}|[0-9]{0,3}[A-HJ-NP-Z]|[0-9]{0,2}[A-HJ-NP-Z]{2})"
+)
+
 
 def is_aircraft_registration(text):
     """Check if text contains an aircraft registration number."""
-    # Pattern for aircraft registrations (e.g., OY-RCM, G-ABCD, N12345)
-    pattern = r"[A-Z]{1,2}-[A-Z0-9]{2,5}"
-    return bool(re.search(pattern, text))
+    return bool(_REGISTRATION_RE.search(text))
 
 
 def is_image_url(url):
     """Check if a URL points to an image."""
-    image_extensions = [
-        ".jpg",
-        ".jpeg",
-        ".png",
-        ".gif",  # Common formats
-        ".webp",  # Web-optimized format
-        ".bmp",
-        ".tiff",
-        ".tif",  # Other standard formats
-        ".heic",
-        ".heif",  # High-efficiency formats
-    ]
-    return any(url.lower().endswith(ext) for ext in image_extensions)
-
-
-def load_processed_submissions():
-    """Load the list of previously processed submission IDs from CSV."""
-    try:
-        with open("submissions.csv", "r") as f:
-            return set(line.strip() for line in f)
-    except FileNotFoundError:
-        return set()
+    return url.lower().endswith(IMAGE_EXTENSIONS)
 
 
-def save_processed_submission(submission_id):
-    """Append a processed submission ID to the CSV file."""
-    with open("submissions.csv", "a") as f:
-        f.write(f"{submission_id}\n")
+def open_submissions_db():
+    """Open the SQLite database of previously processed submission IDs."""
+    db = sqlite3.connect(SUBMISSIONS_DB)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    with db:
+        db.execute("CREATE TABLE IF NOT EXISTS seen(id TEXT PRIMARY KEY)")
+
+        # Carry over the IDs recorded by the old CSV file
+        try:
+            with open(LEGACY_SUBMISSIONS_CSV, "r") as f:
+                db.executemany(
+                    "INSERT OR IGNORE INTO seen(id) VALUES (?)",
+                    ((line.strip(),) for line in f if line.strip()),
+                )
+            os.rename(LEGACY_SUBMISSIONS_CSV, f"{LEGACY_SUBMISSIONS_CSV}.migrated")
+        except FileNotFoundError:
+            pass
+
+    return db
+
+
+def is_submission_processed(db, submission_id):
+    """Check whether a submission ID has already been processed."""
+    row = db.execute("SELECT 1 FROM seen WHERE id = ?", (submission_id,)).fetchone()
+    return row is not None
+
+
+def save_processed_submission(db, submission_id):
+    """Record a processed submission ID in the database."""
+    with db:
+        db.execute("INSERT OR IGNORE INTO seen(id) VALUES (?)", (submission_id,))
 
 
 def get_image_urls_from_submission(submission):
     """Extract image URLs from a submission, handling both direct images and galleries."""
-    if hasattr(submission, "gallery_data"):
+    # Listings already include gallery_data for gallery posts; checking the
+    # loaded attributes instead of hasattr() avoids PRAW lazily fetching
+    # every other submission from Reddit just to find it missing
+    if "gallery_data" in vars(submission):
         # Handle gallery posts
         image_urls = []
         try:
@@ -87,6 +155,15 @@ def is_submission_recent(submission, max_age_hours=1):
     return True
 
 
+def find_registration_in_image(image_url):
+    """OCR an image, only escalating to further OCR passes while nothing is found."""
+    for text in iter_text_from_image(image_url):
+        registration = extract_registrations(text)
+        if registration:
+            return registration
+    return None
+
+
 def process_subreddit(subreddit_name):
     # Initialize Reddit instance with write permissions
     reddit = praw.Reddit(
@@ -100,66 +177,71 @@ def process_subreddit(subreddit_name):
     # Get the subreddit
     subreddit = reddit.subreddit(subreddit_name)
 
-    # Load previously processed submissions
-    processed_submissions = load_processed_submissions()
-    print(f"Loaded {len(processed_submissions)} previously processed submissions")
+    # Open the database of previously processed submissions
+    with closing(open_submissions_db()) as db:
+        print(f"\nMonitoring r/{subreddit_name} for new submissions...")
+        print("-" * 50)
 
-    print(f"\nMonitoring r/{subreddit_name} for new submissions...")
-    print("-" * 50)
+        # Fetch the listing up front and keep only the submissions to process
+        pending = []
+        for submission in subreddit.new(limit=25):  # Changed from hot() to new()
+            # Skip if already processed
+            if is_submission_processed(db, submission.id):
+                print(f"\n⏭️  Skipping submission: {submission.title}")
+                print(f"   ID: {submission.id}")
+                continue
 
-    # Process new submissions
-    for submission in subreddit.new(limit=25):  # Changed from hot() to new()
-        # Skip if already processed
-        if submission.id in processed_submissions:
-            print(f"\n⏭️  Skipping submission: {submission.title}")
-            print(f"   ID: {submission.id}")
-            continue
-
-        # Skip if submission is too old
-        if not is_submission_recent(submission):
-            continue
-
-        # Get all image URLs from the submission
-        image_urls = get_image_urls_from_submission(submission)
-
-        if not image_urls:
-            print(f"\n⏩  Skipping non-image submission: {submission.title}")
-            print(f"   URL: {submission.url}")
-            continue
-
-        print(
-            f"\n📸 Processing submission with {len(image_urls)} image(s): {submission.title}"
-        )
-
-        # Process each image in the submission
-        all_registrations = {}
-        for i, image_url in enumerate(image_urls, 1):
-            print(f"\nProcessing image {i}/{len(image_urls)}")
-            print(f"URL: {image_url}")
-
-            # Extract text from image
-            text = extract_text_from_image(image_url)
-
-            # Extract registration number from text
-            registration = extract_registrations(text)
-
-            if registration:
-                print(f"Found aircraft registration: {registration}")
-                result = process_registration(registration)
-
-                if result:
-                    all_registrations[registration] = result
-
-        # Post a single comment with all registrations found
-        if all_registrations:
-            post_comment(submission, all_registrations)
-        else:
-            print("No valid aircraft registrations found in any images.")
-
-        # Record that we've processed this submission
-        save_processed_submission(submission.id)
-        processed_submissions.add(submission.id)
-        print("-" * 50)
+            # Skip if submission is too old
+            if not is_submission_recent(submission):
+                continue
+
+            pending.append(submission)
+
+        # Process new submissions
+        for submission in pending:
+            # Get all image URLs from the submission
+            image_urls = get_image_urls_from_submission(submission)
+
+            if not image_urls:
+                print(f"\n⏩  Skipping non-image submission: {submission.title}")
+                print(f"   URL: {submission.url}")
+                continue
+
+            print(
+                f"\n📸 Processing submission with {len(image_urls)} image(s): {submission.title}"
+            )
+
+            # OCR all images concurrently, then look up each registration once
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                found = executor.map(find_registration_in_image, image_urls)
+
+                registrations = []
+                for i, (image_url, registration) in enumerate(
+                    zip(image_urls, found), 1
+                ):
+                    with print_lock:
+                        print(f"\nProcessed image {i}/{len(image_urls)}")
+                        print(f"URL: {image_url}")
+
+                        if registration and registration not in registrations:
+                            print(f"Found aircraft registration: {registration}")
+                            registrations.append(registration)
+
+                results = executor.map(lookup_registration, registrations)
+                all_registrations = {}
+                for registration, result in zip(registrations, results):
+                    if result:
+                        all_registrations[registration] = result
+
+            # Post a single comment with all registrations found
+            if all_registrations:
+                post_comment(submission, all_registrations)
+            else:
+                print("No valid aircraft registrations found in any images.")
+
+            # Record that we've processed this submission
+            save_processed_submission(db, submission.id)
+            print("-" * 50)
 
 
 def format_flight_info(result):
@@ -215,65 +297,50 @@ def post_comment(submission, registrations_info):
         print(f"\n❌ Error posting comment: {str(e)}")
 
 
+def fix_ocr_errors(registration):
+    """Replace the letter O with a zero in N-numbers, which never use O."""
+    # Hyphenated marks like G-BOAC or SE-ROA use the letter O legitimately
+    if "-" in registration:
+        return registration
+    return registration.replace("O", "0")
+
+
+def _validate_registration(registration):
+    """Cheaply reject OCR noise before it costs a Flightradar24 lookup."""
+    # Hyphenated marks are already constrained by their pattern; N-numbers
+    # have to follow the FAA format as well
+    return "-" in registration or bool(_VALID_N_NUMBER_RE.fullmatch(registration))
+
+
 def extract_registrations(text):
     """Extract aircraft registrations from text."""
-    # First, clean up any extra whitespace and make text consistent
-    text = re.sub(r"\s+", " ", text).strip()
-    print("\nProcessed text:", text)  # Debug output
-
-    registrations = []
-
-    # Common registration patterns
-    patterns = [
-        # N-numbers (US) - Must be N followed by at least 2 digits/letters
-        (r"N[1-9][0-9A-Z]{1,4}(?![A-Z0-9-])", "N-number"),
-        # Standard hyphenated (e.g., G-ABCD, OY-RCM)
-        (
-            r"(?:G|OY|SE|PH|D|F|EC|HB|TC|VH|ZK|JA|HL|B|VT|EI|4X|P4|A6|VP|C|LV|LN|SP|CS|RA|HS|RP|9M|PK)-[A-Z0-9]{3,5}(?![A-Z0-9-])",
-            "Hyphenated",
-        ),
-    ]
-
-    # Words that often create false positives
-    false_positives = {
-        "3D-ANSICHT",
-        "3D-VIEW",
-        "D-ANSIC",
-        "F-SUR",
-        "D-INFO",
-        "3D-AI",
-        "D-VIEW",
-        "F-SHARE",
-        "D-MENU",
-        "N-MENU",
-    }
+    # Runs in OCR workers; hold the lock so this text's debug output stays together
+    with print_lock:
+        # The patterns never span whitespace, so the text is scanned as-is and
+        # only the matched registration gets normalized
+        print("\nProcessed text:", text.strip())  # Debug output
 
-    for pattern, reg_type in patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
-            registration = match.group(0).upper()
+        for match in _EXTRACT_RE.finditer(text):
+            reg_type = _REG_TYPES[match.lastgroup]
+
+            # Clean up common OCR errors before comparing against known words
+            registration = fix_ocr_errors(match.group(match.lastgroup).upper())
 
             # Skip if it's a known false positive
-            if registration in false_positives:
+            if registration in FALSE_POSITIVES:
                 print(f"Skipping false positive: {registration}")
                 continue
 
-            # Clean up common OCR errors
-            registration = registration.replace(
-                "O", "0"
-            )  # Replace O with 0 in registrations
-
-            # Skip duplicates
-            if registration not in registrations:
-                print(f"Found {reg_type}: {registration}")
-                registrations.append(registration)
+            if not _validate_registration(registration):
+                print(f"Skipping invalid registration: {registration}")
+                continue
 
-    # If we found any registrations, return the first one
-    # In the future, we might want to return all of them or pick based on some criteria
-    if registrations:
-        return registrations[0]
+            # Only the first registration is used, so stop scanning here
+            # In the future, we might want to return all of them or pick based on some criteria
+            print(f"Found {reg_type}: {registration}")
+            return registration
 
-    return None
+        return None
 
 
 def process_submission(submission):
@@ -281,18 +348,15 @@ def process_submission(submission):
     print(f"\nProcessing submission: {submission.title}")
     print(f"URL: {submission.url}")
 
-    # Extract text from image if it's an image post
+    # Extract registration number from the image if it's an image post
     if is_image_url(submission.url):
-        text = extract_text_from_image(submission.url)
+        registration = find_registration_in_image(submission.url)
     else:
-        text = submission.selftext
-
-    # Extract registration number from text
-    registration = extract_registrations(text)
+        registration = extract_registrations(submission.selftext)
 
     if registration:
         print(f"Found aircraft registration: {registration}")
-        result = process_registration(registration)
+        result = lookup_registration(registration)
 
         if result:
             print(f"- {registration}")